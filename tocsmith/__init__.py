@@ -1,9 +1,31 @@
 __all__ = [
     "Heading",
+    "HeadingCheck",
     "parse_toc_lines",
     "generate_bookmarks",
+    "verify_headings",
+    "fix_headings",
+    "PageText",
+    "TextSpan",
+    "PageTextCache",
+    "extract_page_text",
+    "PdfPreflightError",
+    "PreflightResult",
+    "preflight_pdf",
 ]
 
-from .core import Heading, parse_toc_lines, generate_bookmarks  # noqa: E402
-
-
+from .core import (  # noqa: E402
+    Heading,
+    HeadingCheck,
+    parse_toc_lines,
+    generate_bookmarks,
+    verify_headings,
+    fix_headings,
+    PageText,
+    TextSpan,
+    PageTextCache,
+    extract_page_text,
+    PdfPreflightError,
+    PreflightResult,
+    preflight_pdf,
+)
@@ -1,11 +1,29 @@
 from __future__ import annotations
 
 import argparse
+from concurrent.futures import ThreadPoolExecutor
+import fnmatch
+import itertools
+import os
 from pathlib import Path
-from typing import Any, Dict, List, Optional
+import queue
+import re
+import threading
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
 import sys
 
-from .core import generate_bookmarks, parse_toc_lines
+from pypdf import PdfReader
+
+from .core import (
+    Heading,
+    PageTextCache,
+    PdfPreflightError,
+    fix_headings,
+    generate_bookmarks,
+    parse_toc_lines,
+    preflight_pdf,
+    verify_headings,
+)
 
 try:  # Python 3.11+
     import tomllib  # type: ignore[attr-defined]
@@ -23,6 +41,21 @@ def parse_args(argv: List[str] | None = None) -> argparse.Namespace:
     p.add_argument("--min-len", type=int, default=3, help="Minimum heading text length")
     p.add_argument("--page-offset", type=int, default=0, help="Page offset: actual - book page")
     p.add_argument("--toc-file", help="Path to a text file containing TOC lines")
+    p.add_argument(
+        "--verify",
+        choices=["report", "fix"],
+        help="Check heading titles against page text; 'fix' moves mismatched bookmarks",
+    )
+    p.add_argument(
+        "--password",
+        action="append",
+        default=[],
+        help="Password to try for encrypted PDFs (repeatable)",
+    )
+    p.add_argument(
+        "--cache-dir",
+        help="Directory for the persistent page text cache (reused across runs)",
+    )
     p.add_argument(
         "-c",
         "--config",
@@ -46,11 +79,14 @@ def _run_single(
     page_offset: int,
     min_len: int,
     toc_text: Optional[str] = None,
+    verify: Optional[str] = None,
+    cache: Optional[PageTextCache] = None,
+    passwords: Sequence[str] = (),
 ) -> int:
-    """Run a single task and return process exit code."""
-    if not src.exists():
-        print(f"File not found: {src}")
-        return 2
+    """Run a single task and return process exit code.
+
+    Raises PdfPreflightError if the input is rejected before any page copying.
+    """
     out_path = out if out else src.with_suffix(".bookmarked.pdf")
 
     headings = []
@@ -62,13 +98,206 @@ def _run_single(
     else:
         print("No TOC source provided (use --toc-file). Producing a copy without outline.")
         headings = []
+    pre = preflight_pdf(src, passwords=passwords, headings=headings)
+    if pre.recovered:
+        print(f"Warning: {src} is damaged; recovered by rebuilding its xref table")
+    for h in pre.out_of_range:
+        print(f"Warning: '{h.title}' page {h.page} is past the last page ({pre.num_pages})")
     if not headings:
         print("No headings; output will be a copy without outline.")
-    generate_bookmarks(str(src), str(out_path), headings)
+    elif verify:
+        headings = _verify(
+            src,
+            headings,
+            fix=(verify == "fix"),
+            cache=cache,
+            password=pre.password,
+            num_pages=pre.num_pages,
+            reader=pre.reader,
+        )
+    generate_bookmarks(str(src), str(out_path), headings, password=pre.password, reader=pre.reader)
     print(f"Wrote: {out_path}")
     return 0
 
 
+def _verify(
+    src: Path,
+    headings: List[Heading],
+    fix: bool,
+    cache: Optional[PageTextCache] = None,
+    password: Optional[str] = None,
+    num_pages: Optional[int] = None,
+    reader: Optional[PdfReader] = None,
+) -> List[Heading]:
+    """Report headings whose title is not found on their page; optionally move them."""
+    checks = verify_headings(
+        str(src), headings, cache=cache, password=password, num_pages=num_pages, reader=reader
+    )
+    mismatched = [c for c in checks if not c.ok]
+    for c in mismatched:
+        if not c.matched:
+            print(
+                f"Not found: '{c.heading.title}' page {c.heading.page} "
+                f"(score {c.score:.2f}); left unchanged"
+            )
+            continue
+        action = "moved" if fix else "suggest"
+        print(
+            f"Mismatch: '{c.heading.title}' page {c.heading.page} "
+            f"(score {c.score:.2f}) -> {action} page {c.best_page} (score {c.best_score:.2f})"
+        )
+    print(f"Verified {len(checks)} heading(s), {len(mismatched)} mismatch(es)")
+    return fix_headings(checks) if fix else headings
+
+
+def _int_setting(table: Dict[str, Any], key: str, default: int) -> int:
+    """Read an int config value; only a missing key falls back, so 0 is honoured."""
+    value = table.get(key)
+    return default if value is None else int(value)
+
+
+def _glob_to_regex(pattern: str) -> "re.Pattern[str]":
+    """Translate a glob over '/'-separated relative paths; '**/' spans directories."""
+    out = []
+    i = 0
+    while i < len(pattern):
+        if pattern.startswith("**/", i):
+            out.append("(?:.*/)?")
+            i += 3
+        elif pattern.startswith("**", i):
+            out.append(".*")
+            i += 2
+        elif pattern[i] == "*":
+            out.append("[^/]*")
+            i += 1
+        elif pattern[i] == "?":
+            out.append("[^/]")
+            i += 1
+        else:
+            out.append(re.escape(pattern[i]))
+            i += 1
+    return re.compile("".join(out) + r"\Z")
+
+
+def _iter_glob(root: Path, pattern: str, max_workers: int = 8) -> Iterator[Path]:
+    """
+    Lazily yield files under root whose relative path matches pattern.
+    Directories are scanned concurrently and matches are yielded as soon as
+    each directory is listed, so callers can start work before the walk ends.
+    Files within a directory come out sorted by name; the order in which
+    directories are yielded depends on scan timing and may differ between runs.
+    """
+    regex = _glob_to_regex(pattern)
+    parts = pattern.split("/")
+    results: "queue.Queue[Optional[List[Path]]]" = queue.Queue()
+    stop = threading.Event()
+    lock = threading.Lock()
+    pending = [0]
+
+    def may_descend(name: str, depth: int) -> bool:
+        # Prune on literal/wildcard segments until the first '**', which spans any depth
+        if any("**" in part for part in parts[: depth + 1]):
+            return True
+        return depth < len(parts) - 1 and fnmatch.fnmatchcase(name, parts[depth])
+
+    def scan(directory: Path, rel: str, depth: int) -> None:
+        try:
+            if stop.is_set():
+                return
+            try:
+                entries = sorted(os.scandir(directory), key=lambda e: e.name)
+            except OSError:
+                entries = []
+            matches: List[Path] = []
+            for entry in entries:
+                rel_path = f"{rel}{entry.name}"
+                try:
+                    # Symlinked directories are not followed, so link cycles cannot loop
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                except OSError:
+                    continue
+                if is_dir:
+                    if may_descend(entry.name, depth):
+                        submit(Path(entry.path), rel_path + "/", depth + 1)
+                elif regex.match(rel_path):
+                    matches.append(Path(entry.path))
+            if matches:
+                results.put(matches)
+        finally:
+            with lock:
+                pending[0] -= 1
+                if pending[0] == 0:
+                    results.put(None)
+
+    def submit(directory: Path, rel: str, depth: int) -> None:
+        if stop.is_set():
+            return  # consumer went away; the pool may already be shut down
+        with lock:
+            pending[0] += 1
+        try:
+            pool.submit(scan, directory, rel, depth)
+        except RuntimeError:
+            with lock:
+                pending[0] -= 1
+
+    pool = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        submit(root, "", 0)
+        while True:
+            batch = results.get()
+            if batch is None:
+                return
+            yield from batch
+    finally:
+        stop.set()
+        pool.shutdown(wait=True)
+
+
+def _split_front_matter(text: str) -> Tuple[Dict[str, Any], str]:
+    """Split optional TOML front matter delimited by '+++' lines from a sidecar TOC."""
+    lines = text.splitlines()
+    if not lines or lines[0].strip() != "+++":
+        return {}, text
+    for end in range(1, len(lines)):
+        if lines[end].strip() == "+++":
+            meta = tomllib.loads("\n".join(lines[1:end])) if tomllib is not None else {}
+            return meta, "\n".join(lines[end + 1 :])
+    return {}, text
+
+
+def _discover_sources(
+    sources: List[Dict[str, Any]], input_base: Path, output_suffix: str
+) -> Iterator[Dict[str, Any]]:
+    """Yield task dicts for PDFs matched by [[sources]] globs that have a sidecar TOC."""
+    for sidx, source in enumerate(sources, start=1):
+        pattern = str(source.get("glob") or "**/*.pdf")
+        toc_suffix = str(source.get("toc_suffix") or ".toc.txt")
+        for pdf in _iter_glob(input_base, pattern):
+            if pdf.name.endswith(output_suffix):
+                continue  # previously generated output
+            sidecar = pdf.with_name(f"{pdf.stem}{toc_suffix}")
+            if not sidecar.is_file():
+                print(f"[Source {sidx}] Skipped (no {toc_suffix} sidecar): {pdf}")
+                continue
+            rel = pdf.relative_to(input_base)
+            try:
+                meta, toc_text = _split_front_matter(sidecar.read_text(encoding="utf-8"))
+            except Exception as e:
+                yield {"input_file": rel.as_posix(), "error": f"bad sidecar {sidecar}: {e}"}
+                continue
+            task: Dict[str, Any] = {
+                k: source[k] for k in ("page_offset", "min_len", "verify") if k in source
+            }
+            task.update({k: meta[k] for k in ("page_offset", "min_len", "verify") if k in meta})
+            task.update(
+                input_file=rel.as_posix(),
+                output_dir=rel.parent.as_posix(),
+                toc=toc_text,
+                toc_label=str(sidecar),
+            )
+            yield task
+
+
 def _run_batch(config_path: Path) -> int:
     '''Run batch tasks from a TOML config file.
 
@@ -79,6 +308,9 @@ def _run_batch(config_path: Path) -> int:
     input_prefix = "input"              # optional; base dir for input files
     output_prefix = "output"            # optional; base dir for outputs
     output_suffix = ".bookmarked.pdf"   # optional; appended to stem
+    verify = "report"                   # optional; "report" or "fix"
+    cache_dir = ".tocsmith-cache"       # optional; persistent page text cache
+    passwords = ["secret"]              # optional; tried on encrypted PDFs
 
     [[tasks]]
     input_file = "book1.pdf"            # required; relative to input_prefix
@@ -86,6 +318,18 @@ def _run_batch(config_path: Path) -> int:
     # Alternatively: toc_file = "toc.txt"
     page_offset = 10                     # optional overrides default
     min_len = 2                          # optional overrides default
+    verify = "fix"                       # optional overrides default
+    output_dir = "sub"                   # optional; relative to output_prefix
+    passwords = ["book1-pw"]             # optional; tried before default passwords
+
+    [[sources]]                          # discover tasks instead of listing them
+    glob = "**/*.pdf"                    # relative to input_prefix
+    toc_suffix = ".toc.txt"              # sidecar TOC: book.pdf -> book.toc.txt
+    page_offset = 0                      # optional; sidecar front matter wins
+    # Sidecar front matter (optional, TOML between '+++' lines):
+    # +++
+    # page_offset = 12
+    # +++
     '''
     if tomllib is None:
         print("Error: TOML support not available. Please install 'tomli' for Python < 3.11.")
@@ -101,27 +345,41 @@ def _run_batch(config_path: Path) -> int:
     base_dir = config_path.parent
     defaults: Dict[str, Any] = data.get("defaults", {}) or {}
     tasks: List[Dict[str, Any]] = data.get("tasks", []) or []
-    if not isinstance(tasks, list) or not tasks:
-        print("No tasks found in config (expected [[tasks]] array)")
+    sources: List[Dict[str, Any]] = data.get("sources", []) or []
+    if not isinstance(tasks, list) or not isinstance(sources, list) or not (tasks or sources):
+        print("No tasks found in config (expected [[tasks]] or [[sources]] array)")
         return 2
 
-    default_page_offset = int(defaults.get("page_offset", 0) or 0)
-    default_min_len = int(defaults.get("min_len", 3) or 3)
+    default_page_offset = _int_setting(defaults, "page_offset", 0)
+    default_min_len = _int_setting(defaults, "min_len", 3)
     input_prefix = str(defaults.get("input_prefix", "")).strip() or ""
     output_prefix = str(defaults.get("output_prefix", "")).strip() or ""
     output_suffix = (
         str(defaults.get("output_suffix", ".bookmarked.pdf")).strip() or ".bookmarked.pdf"
     )
 
+    default_verify: Optional[str] = defaults.get("verify") or None
+    cache_dir = _resolve_relative(base_dir, defaults.get("cache_dir"))
+    cache = PageTextCache(cache_dir) if cache_dir else None
+    default_passwords = [str(p) for p in (defaults.get("passwords") or [])]
+
     input_base = (base_dir / input_prefix).resolve() if input_prefix else base_dir
     output_base = (base_dir / output_prefix).resolve() if output_prefix else base_dir
 
     failures = 0
-    for idx, t in enumerate(tasks, start=1):
+    categories: Dict[str, int] = {}
+    all_tasks = itertools.chain(tasks, _discover_sources(sources, input_base, output_suffix))
+    for idx, t in enumerate(all_tasks, start=1):
         input_file_val = t.get("input_file")
         if not input_file_val:
             print(f"[Task {idx}] Skipped: missing 'input_file'")
             failures += 1
+            categories["config"] = categories.get("config", 0) + 1
+            continue
+        if t.get("error"):
+            print(f"[Task {idx}] Failed: {t['error']}")
+            failures += 1
+            categories["config"] = categories.get("config", 0) + 1
             continue
 
         # Resolve input file relative to input_base
@@ -132,17 +390,34 @@ def _run_batch(config_path: Path) -> int:
             out_stem = Path(str(input_file_val)).stem
         except Exception:
             out_stem = "output"
-        out = (output_base / f"{out_stem}{output_suffix}").resolve()
+        out_dir = output_base / str(t.get("output_dir") or "")
+        out = (out_dir / f"{out_stem}{output_suffix}").resolve()
 
         # Obtain TOC from inline 'toc' or optional 'toc_file' fallback
         toc_inline: Optional[str] = t.get("toc")
         toc_file = _resolve_relative(base_dir, t.get("toc_file"))
-        page_offset = int(t.get("page_offset", default_page_offset) or default_page_offset)
-        min_len = int(t.get("min_len", default_min_len) or default_min_len)
+        try:
+            page_offset = _int_setting(t, "page_offset", default_page_offset)
+            min_len = _int_setting(t, "min_len", default_min_len)
+        except (TypeError, ValueError) as e:
+            where = t.get("toc_label") or "task"
+            print(f"[Task {idx}] Skipped: invalid 'page_offset'/'min_len' in {where}: {e}")
+            failures += 1
+            categories["config"] = categories.get("config", 0) + 1
+            continue
+        verify: Optional[str] = t.get("verify", default_verify) or None
+        if verify not in (None, "report", "fix"):
+            print(f"[Task {idx}] Skipped: invalid 'verify' value {verify!r}")
+            failures += 1
+            categories["config"] = categories.get("config", 0) + 1
+            continue
 
+        toc_desc = t.get("toc_label") or (
+            "inline" if (toc_inline and toc_inline.strip()) else (toc_file or "<none>")
+        )
         print(
             f"[Task {idx}] Running: src={src} out={out} "
-            f"toc={'inline' if (toc_inline and toc_inline.strip()) else (toc_file or '<none>')} "
+            f"toc={toc_desc} "
             f"offset={page_offset} min_len={min_len}"
         )
         try:
@@ -155,15 +430,27 @@ def _run_batch(config_path: Path) -> int:
                 page_offset=page_offset,
                 min_len=min_len,
                 toc_text=toc_inline,
+                verify=verify,
+                cache=cache,
+                passwords=[str(p) for p in (t.get("passwords") or [])] + default_passwords,
             )
             if code != 0:
                 failures += 1
+                categories["failed"] = categories.get("failed", 0) + 1
+        except PdfPreflightError as e:
+            failures += 1
+            categories[e.category] = categories.get(e.category, 0) + 1
+            print(f"[Task {idx}] Rejected ({e.category}): {e}")
         except Exception as e:
             failures += 1
+            categories["error"] = categories.get("error", 0) + 1
             print(f"[Task {idx}] Failed: {e}")
 
+    if cache is not None:
+        cache.close()
     if failures:
-        print(f"Completed with {failures} failure(s)")
+        detail = ", ".join(f"{k}: {v}" for k, v in sorted(categories.items()))
+        print(f"Completed with {failures} failure(s)" + (f" ({detail})" if detail else ""))
         return 1
     print("All tasks completed successfully")
     return 0
@@ -180,13 +467,24 @@ def main(argv: List[str] | None = None) -> int:
 
     src = Path(ns.pdf)
     out = Path(ns.out) if ns.out else None
-    return _run_single(
-        src=src,
-        out=out,
-        toc_file=Path(ns.toc_file) if ns.toc_file else None,
-        page_offset=ns.page_offset,
-        min_len=ns.min_len,
-    )
+    cache = PageTextCache(ns.cache_dir) if ns.cache_dir else None
+    try:
+        return _run_single(
+            src=src,
+            out=out,
+            toc_file=Path(ns.toc_file) if ns.toc_file else None,
+            page_offset=ns.page_offset,
+            min_len=ns.min_len,
+            verify=ns.verify,
+            cache=cache,
+            passwords=ns.password,
+        )
+    except PdfPreflightError as e:
+        print(f"Error ({e.category}): {e}")
+        return 2
+    finally:
+        if cache is not None:
+            cache.close()
 
 
 if __name__ == "__main__":  # pragma: no cover
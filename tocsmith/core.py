@@ -1,10 +1,19 @@
 from __future__ import annotations
 
-from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field
+import hashlib
+import io
+import json
+import os
+from pathlib import Path
 import re
-from typing import Iterable, List, Tuple, Optional
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, List, Tuple, Optional, Sequence, Set, Union
 
-from pypdf import PdfReader, PdfWriter
+from pypdf import PasswordType, PdfReader, PdfWriter
+from pypdf.errors import FileNotDecryptedError, PdfReadError
 
 
 @dataclass
@@ -14,9 +23,41 @@ class Heading:
     level: int  # 1..6
 
 
-def generate_bookmarks(src_pdf: str, out_pdf: str, headings: Iterable[Heading]) -> None:
-    """Write given headings into a new PDF file as outline/bookmarks."""
-    reader = PdfReader(src_pdf)
+# Appended to a damaged file so pypdf finds a (bogus) startxref, rejects it and
+# rebuilds the cross-reference table by scanning for objects
+_RECOVERY_TRAILER = b"\nstartxref\n0\n%%EOF\n"
+
+
+def _open_pdf(src_pdf: Union[str, Path], password: Optional[str] = None) -> Tuple[PdfReader, bool]:
+    """Open a PDF, retrying with a rebuilt xref table; return (reader, recovered)."""
+    try:
+        return PdfReader(str(src_pdf), strict=False, password=password), False
+    except FileNotDecryptedError:
+        raise  # wrong password: the file parsed fine, recovery cannot help
+    except (PdfReadError, ValueError, KeyError, IndexError) as first_error:
+        # Only structural parse errors get the in-memory retry
+        data = Path(src_pdf).read_bytes() + _RECOVERY_TRAILER
+        try:
+            reader = PdfReader(io.BytesIO(data), strict=False, password=password)
+            len(reader.pages)  # the page tree must survive recovery too
+        except Exception:
+            raise first_error
+        return reader, True
+
+
+def generate_bookmarks(
+    src_pdf: str,
+    out_pdf: str,
+    headings: Iterable[Heading],
+    password: Optional[str] = None,
+    reader: Optional[PdfReader] = None,
+) -> None:
+    """Write given headings into a new PDF file as outline/bookmarks.
+
+    reader, when given (e.g. PreflightResult.reader), is used instead of reopening src_pdf.
+    """
+    if reader is None:
+        reader, _ = _open_pdf(src_pdf, password=password)
     writer = PdfWriter()
     for page in reader.pages:
         writer.add_page(page)
@@ -36,6 +77,91 @@ def generate_bookmarks(src_pdf: str, out_pdf: str, headings: Iterable[Heading])
         writer.write(f)
 
 
+# -------------------- Preflight checks --------------------
+
+_HEADER_PROBE = 1024
+
+
+class PdfPreflightError(Exception):
+    """
+    Input PDF rejected before any page copying.
+    category is one of "missing", "not_pdf", "encrypted", "corrupt", "empty".
+    """
+
+    def __init__(self, category: str, message: str) -> None:
+        super().__init__(message)
+        self.category = category
+
+
+@dataclass
+class PreflightResult:
+    num_pages: int
+    encrypted: bool
+    password: Optional[str]  # password that opened the file, if it was encrypted
+    recovered: bool  # normal open failed; opened after rebuilding the xref table
+    out_of_range: List[Heading] = field(default_factory=list)
+    # Opened (and decrypted) reader, for reuse by generate_bookmarks/verify_headings
+    reader: Optional[PdfReader] = field(default=None, repr=False, compare=False)
+
+
+def preflight_pdf(
+    src_pdf: Union[str, Path],
+    passwords: Sequence[str] = (),
+    headings: Optional[Iterable[Heading]] = None,
+) -> PreflightResult:
+    """
+    Cheaply validate a PDF before generating bookmarks.
+    - The header is probed directly; non-PDFs fail without parsing
+    - Files that fail to open (e.g. truncated before %%EOF) are retried with a
+      rebuilt cross-reference table; recovered reports whether that was needed
+    - Encrypted files are tried with the empty password, then each of passwords
+    - Headings pointing past the last page are reported in out_of_range
+    Raises PdfPreflightError with a category on failure.
+    """
+    path = Path(src_pdf)
+    if not path.is_file():
+        raise PdfPreflightError("missing", f"File not found: {path}")
+    with path.open("rb") as f:
+        head = f.read(_HEADER_PROBE)
+    if b"%PDF-" not in head:
+        raise PdfPreflightError("not_pdf", f"Not a PDF (missing %PDF- header): {path}")
+
+    try:
+        reader, recovered = _open_pdf(path)
+    except Exception as e:
+        raise PdfPreflightError("corrupt", f"Unreadable PDF {path}: {e}") from e
+
+    password: Optional[str] = None
+    if reader.is_encrypted:
+        for candidate in ("", *passwords):
+            try:
+                if reader.decrypt(candidate) != PasswordType.NOT_DECRYPTED:
+                    password = candidate
+                    break
+            except Exception as e:
+                # e.g. AES without the optional 'cryptography' dependency
+                raise PdfPreflightError("encrypted", f"Cannot decrypt {path}: {e}") from e
+        else:
+            raise PdfPreflightError("encrypted", f"Encrypted PDF, no matching password: {path}")
+
+    try:
+        num_pages = len(reader.pages)
+    except Exception as e:
+        raise PdfPreflightError("corrupt", f"Broken page tree in {path}: {e}") from e
+    if num_pages == 0:
+        raise PdfPreflightError("empty", f"PDF has no pages: {path}")
+
+    out_of_range = [h for h in (headings or []) if h.page > num_pages]
+    return PreflightResult(
+        num_pages=num_pages,
+        encrypted=reader.is_encrypted,
+        password=password,
+        recovered=recovered,
+        out_of_range=out_of_range,
+        reader=reader,
+    )
+
+
 # -------------------- TOC parsing utilities --------------------
 
 _NUM_PREFIX_RE = re.compile(
@@ -117,6 +243,457 @@ def parse_toc_lines(toc_text: str, page_offset: int = 0, min_len: int = 1) -> Li
     return headings
 
 
+# -------------------- Page verification --------------------
+
+_NGRAM_SIZE = 3
+_NORMALIZE_RE = re.compile(r"[\W_]+", re.UNICODE)
+_CJK_RE = re.compile(r"[\u3040-\u30ff\u3400-\u9fff\uac00-\ud7af]")
+# Below this many pages to extract, process start-up costs more than it saves
+_PROCESS_POOL_MIN_PAGES = 64
+
+
+@dataclass
+class HeadingCheck:
+    heading: Heading
+    score: float  # best line similarity on the heading's own page, 0..1
+    best_page: int  # 1-based page chosen within the search window
+    best_score: float
+    matched: bool  # best_score reached the threshold on some page in the window
+
+    @property
+    def ok(self) -> bool:
+        return self.matched and self.best_page == self.heading.page
+
+
+def _normalize_text(text: str) -> str:
+    # Drop whitespace/punctuation so spacing and hyphenation differences
+    # between the TOC and the page text do not split n-grams
+    return _NORMALIZE_RE.sub("", text).lower()
+
+
+def _ngrams(text: str, n: int = _NGRAM_SIZE) -> Set[str]:
+    if len(text) <= n:
+        return {text} if text else set()
+    return {text[i : i + n] for i in range(len(text) - n + 1)}
+
+
+def _gram_size(title: str) -> int:
+    # Bigrams for short and CJK titles, trigrams everything else
+    return 2 if len(title) <= _NGRAM_SIZE or _CJK_RE.search(title) else _NGRAM_SIZE
+
+
+def _title_for_matching(title: str) -> str:
+    """Strip star markers and numbering so only the heading words are matched."""
+    bare = title.lstrip("*").strip()
+    num_m = _NUM_PREFIX_RE.match(bare)
+    if num_m and num_m.group("num"):
+        rest = bare[num_m.end() :].strip()
+        if rest:
+            bare = rest
+    return _normalize_text(bare)
+
+
+class _PageSpans:
+    """Candidate heading spans of one page: each line and each pair of adjacent lines."""
+
+    def __init__(self, text: str) -> None:
+        lines = [ln for ln in text.splitlines() if ln.strip()]
+        spans = lines + [f"{a} {b}" for a, b in zip(lines, lines[1:])]
+        self.spans = [t for t in (_title_for_matching(sp) for sp in spans) if t]
+        self._grams: Dict[int, List[Set[str]]] = {}
+
+    def grams(self, n: int) -> List[Set[str]]:
+        cached = self._grams.get(n)
+        if cached is None:
+            cached = self._grams[n] = [_ngrams(sp, n) for sp in self.spans]
+        return cached
+
+    def score(self, title: str) -> float:
+        """Best Dice similarity between the title and any single span."""
+        if not title:
+            return 0.0
+        if len(title) < 2:
+            # Single character: n-grams cannot express it, require an exact line
+            return 1.0 if title in self.spans else 0.0
+        title_grams = _ngrams(title, _gram_size(title))
+        best = 0.0
+        for span_grams in self.grams(_gram_size(title)):
+            common = len(title_grams & span_grams)
+            if common:
+                best = max(best, 2 * common / (len(title_grams) + len(span_grams)))
+        return best
+
+
+_worker_reader: Optional[PdfReader] = None
+
+
+def _init_page_worker(src_pdf: str, password: Optional[str]) -> None:
+    global _worker_reader
+    _worker_reader, _ = _open_pdf(src_pdf, password=password)
+
+
+def _extract_in_worker(job: Tuple[int, bool]) -> Tuple[int, Optional[PageText]]:
+    page_index, with_spans = job
+    assert _worker_reader is not None
+    try:
+        if with_spans:
+            return page_index, extract_page_text(_worker_reader, page_index)
+        return page_index, PageText(text=_worker_reader.pages[page_index].extract_text() or "")
+    except Exception:
+        return page_index, None
+
+
+class _PageGrams:
+    """Per-run page text and heading spans; bulk extraction uses worker processes."""
+
+    def __init__(
+        self,
+        src_pdf: str,
+        store: Optional["PageTextCache"] = None,
+        password: Optional[str] = None,
+        reader: Optional[PdfReader] = None,
+    ) -> None:
+        self.src_pdf = src_pdf
+        self.password = password
+        self.store = store
+        self._key = store.pdf_key(src_pdf) if store is not None else None
+        self._reader = reader
+        self._texts: Dict[int, str] = {}
+        self._spans: Dict[int, _PageSpans] = {}
+
+    def _extract(self, page_index: int) -> Optional[PageText]:
+        if self._reader is None:
+            self._reader, _ = _open_pdf(self.src_pdf, password=self.password)
+        try:
+            if self.store is not None:
+                return extract_page_text(self._reader, page_index)
+            return PageText(text=self._reader.pages[page_index].extract_text() or "")
+        except Exception:
+            return None
+
+    def _remember(self, page_index: int, page_text: Optional[PageText]) -> None:
+        if page_text is not None and self.store is not None and self._key is not None:
+            self.store.put(self._key, page_index, page_text)
+        self._texts[page_index] = page_text.text if page_text else ""
+
+    def prefetch(self, page_indexes: Iterable[int], max_workers: Optional[int] = None) -> None:
+        pending = sorted(set(page_indexes) - set(self._texts))
+        if self.store is not None and self._key is not None:
+            missing = []
+            for idx in pending:
+                cached = self.store.get(self._key, idx)
+                if cached is None:
+                    missing.append(idx)
+                else:
+                    self._texts[idx] = cached.text
+            pending = missing
+        workers = min(max_workers or os.cpu_count() or 1, len(pending))
+        if workers <= 1 or len(pending) < _PROCESS_POOL_MIN_PAGES:
+            for idx in pending:
+                self._remember(idx, self._extract(idx))
+            return
+        # pypdf extraction is pure Python and holds the GIL, so use processes,
+        # each with its own reader; contiguous chunks keep IPC round trips low
+        with_spans = self.store is not None
+        jobs = [(idx, with_spans) for idx in pending]
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_page_worker,
+            initargs=(self.src_pdf, self.password),
+        ) as pool:
+            chunksize = max(1, len(jobs) // (workers * 4))
+            for idx, page_text in pool.map(_extract_in_worker, jobs, chunksize=chunksize):
+                self._remember(idx, page_text)
+
+    def page(self, page_index: int) -> _PageSpans:
+        """Return the candidate heading spans of a page, extracting it if needed."""
+        if page_index not in self._texts:
+            self.prefetch([page_index], max_workers=1)
+        spans = self._spans.get(page_index)
+        if spans is None:
+            spans = self._spans[page_index] = _PageSpans(self._texts[page_index])
+        return spans
+
+
+def verify_headings(
+    src_pdf: str,
+    headings: Iterable[Heading],
+    window: int = 1,
+    threshold: float = 0.6,
+    max_workers: Optional[int] = None,
+    cache: Optional["PageTextCache"] = None,
+    password: Optional[str] = None,
+    num_pages: Optional[int] = None,
+    margin: float = 0.15,
+    reader: Optional[PdfReader] = None,
+) -> List[HeadingCheck]:
+    """
+    Check each heading title against the text of its target page and neighbours.
+    - Only pages within +/- window of each heading are extracted; large jobs are
+      split across worker processes
+    - A page scores the best Dice similarity of the title's character n-grams
+      against each line (or pair of adjacent lines) with numbering stripped;
+      bigrams for short or CJK titles, trigrams otherwise
+    - Every page in the window is scored; best_page moves off the printed page
+      only when a neighbour reaches threshold and beats it by margin
+    - matched is False when no page in the window reaches threshold
+    - cache, when given, persists extracted page text across runs
+    - reader / num_pages, when known (e.g. from preflight_pdf), avoid reopening the
+      file; worker processes still open their own copy
+    """
+    hs = list(headings)
+    if reader is None and num_pages is None:
+        reader, _ = _open_pdf(src_pdf, password=password)
+    if num_pages is None:
+        assert reader is not None
+        num_pages = len(reader.pages)
+    if not hs or num_pages == 0:
+        return []
+
+    pages = _PageGrams(src_pdf, store=cache, password=password, reader=reader)
+    needed: Set[int] = set()
+    for h in hs:
+        target = max(0, min(num_pages - 1, h.page - 1))
+        needed.update(range(max(0, target - window), min(num_pages, target + window + 1)))
+    pages.prefetch(needed, max_workers=max_workers)
+
+    checks: List[HeadingCheck] = []
+    for h in hs:
+        title = _title_for_matching(h.title)
+        target = max(0, min(num_pages - 1, h.page - 1))
+        score = pages.page(target).score(title)
+        best_index, best_score = target, score
+        # Nearest pages first so ties resolve towards the printed page number
+        for delta in range(1, window + 1):
+            for idx in (target - delta, target + delta):
+                if 0 <= idx < num_pages:
+                    s = pages.page(idx).score(title)
+                    if s >= threshold and s >= score + margin and s > best_score:
+                        best_index, best_score = idx, s
+        checks.append(
+            HeadingCheck(
+                heading=h,
+                score=score,
+                best_page=best_index + 1,
+                best_score=best_score,
+                matched=best_score >= threshold,
+            )
+        )
+    return checks
+
+
+def fix_headings(checks: Iterable[HeadingCheck]) -> List[Heading]:
+    """Move matched headings to their best page; unmatched headings keep their page."""
+    return [
+        Heading(title=c.heading.title, page=c.best_page, level=c.heading.level)
+        if c.matched
+        else c.heading
+        for c in checks
+    ]
+
+
+# -------------------- Persistent page text cache --------------------
+
+
+@dataclass
+class TextSpan:
+    text: str
+    font: Optional[str]  # BaseFont name, e.g. "/Helvetica"
+    size: float
+    x: float
+    y: float
+
+
+@dataclass
+class PageText:
+    text: str
+    spans: List[TextSpan] = field(default_factory=list)
+
+
+def extract_page_text(reader: PdfReader, page_index: int) -> PageText:
+    """Extract plain text plus positioned font spans from one page."""
+    spans: List[TextSpan] = []
+
+    def visitor(text: str, cm: Any, tm: Any, font_dict: Any, font_size: float) -> None:
+        if not text or not text.strip():
+            return
+        font = str(font_dict.get("/BaseFont")) if font_dict else None
+        spans.append(
+            TextSpan(text=text, font=font, size=float(font_size), x=float(tm[4]), y=float(tm[5]))
+        )
+
+    text = reader.pages[page_index].extract_text(visitor_text=visitor) or ""
+    return PageText(text=text, spans=spans)
+
+
+def default_cache_dir() -> Path:
+    """Return $XDG_CACHE_HOME/tocsmith, falling back to ~/.cache/tocsmith."""
+    base = os.environ.get("XDG_CACHE_HOME") or str(Path.home() / ".cache")
+    return Path(base) / "tocsmith"
+
+
+class PageTextCache:
+    """
+    On-disk cache of extracted page text and font spans, shared across runs.
+    - Backed by SQLite with memory-mapped I/O (mmap_size = max_bytes)
+    - Entries are keyed by the SHA-256 of the PDF content and the 0-based page index
+    - When the stored payload exceeds max_bytes, least recently used entries are evicted
+    """
+
+    _DB_NAME = "pages.sqlite3"
+
+    def __init__(
+        self, cache_dir: Union[str, Path, None] = None, max_bytes: int = 256 * 1024 * 1024
+    ) -> None:
+        self.cache_dir = Path(cache_dir) if cache_dir else default_cache_dir()
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._hashes: Dict[Tuple[str, int, int], str] = {}
+        # One open reader per PDF content hash, so misses do not re-parse the file
+        self._readers: Dict[str, PdfReader] = {}
+        self._reader_lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            str(self.cache_dir / self._DB_NAME), check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(f"PRAGMA mmap_size={int(max_bytes)}")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            " pdf_hash TEXT NOT NULL, page INTEGER NOT NULL, text TEXT NOT NULL,"
+            " spans TEXT NOT NULL, nbytes INTEGER NOT NULL, last_used INTEGER NOT NULL,"
+            " PRIMARY KEY (pdf_hash, page))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS pages_lru ON pages (last_used)")
+        # The byte total lives in the database so processes sharing cache_dir agree on it
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)"
+        )
+        self._conn.execute(
+            "INSERT OR IGNORE INTO meta VALUES"
+            " ('total_bytes', (SELECT COALESCE(SUM(nbytes), 0) FROM pages))"
+        )
+
+    def close(self) -> None:
+        with self._reader_lock:
+            self._readers.clear()
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self) -> "PageTextCache":
+        return self
+
+    def __exit__(self, *exc: object) -> None:
+        self.close()
+
+    @property
+    def total_bytes(self) -> int:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'total_bytes'").fetchone()
+        return int(row[0])
+
+    def pdf_key(self, src_pdf: Union[str, Path]) -> str:
+        """Content hash of a PDF; memoized per (path, size, mtime) within this process."""
+        st = os.stat(src_pdf)
+        memo_key = (os.path.abspath(src_pdf), st.st_size, st.st_mtime_ns)
+        with self._lock:
+            cached = self._hashes.get(memo_key)
+        if cached is not None:
+            return cached
+        h = hashlib.sha256()
+        with open(src_pdf, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(chunk)
+        digest = h.hexdigest()
+        with self._lock:
+            self._hashes[memo_key] = digest
+        return digest
+
+    # LRU clock: one past the newest entry, evaluated atomically inside each statement
+    _NEXT_TICK = "(SELECT COALESCE(MAX(last_used), 0) + 1 FROM pages)"
+
+    def get(self, pdf_hash: str, page_index: int) -> Optional[PageText]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT text, spans FROM pages WHERE pdf_hash = ? AND page = ?",
+                (pdf_hash, page_index),
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute(
+                f"UPDATE pages SET last_used = {self._NEXT_TICK} WHERE pdf_hash = ? AND page = ?",
+                (pdf_hash, page_index),
+            )
+        spans = [TextSpan(**s) for s in json.loads(row[1])]
+        return PageText(text=row[0], spans=spans)
+
+    def put(self, pdf_hash: str, page_index: int, page_text: PageText) -> None:
+        spans = json.dumps([asdict(s) for s in page_text.spans], ensure_ascii=False)
+        nbytes = len(page_text.text.encode("utf-8")) + len(spans.encode("utf-8"))
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            # IMMEDIATE takes the write lock up front, so the read-modify-write of
+            # the byte total cannot interleave with another process
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                old = self._conn.execute(
+                    "SELECT nbytes FROM pages WHERE pdf_hash = ? AND page = ?",
+                    (pdf_hash, page_index),
+                ).fetchone()
+                self._conn.execute(
+                    f"INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, {self._NEXT_TICK})",
+                    (pdf_hash, page_index, page_text.text, spans, nbytes),
+                )
+                self._conn.execute(
+                    "UPDATE meta SET value = value + ? WHERE key = 'total_bytes'",
+                    (nbytes - (int(old[0]) if old else 0),),
+                )
+                self._evict()
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _evict(self) -> None:
+        # Caller holds self._lock inside a write transaction
+        total = int(
+            self._conn.execute("SELECT value FROM meta WHERE key = 'total_bytes'").fetchone()[0]
+        )
+        while total > self.max_bytes:
+            rows = self._conn.execute(
+                "SELECT pdf_hash, page, nbytes FROM pages ORDER BY last_used LIMIT 64"
+            ).fetchall()
+            if not rows:
+                total = 0
+                break
+            for pdf_hash, page, nbytes in rows:
+                self._conn.execute(
+                    "DELETE FROM pages WHERE pdf_hash = ? AND page = ?", (pdf_hash, page)
+                )
+                total -= int(nbytes)
+                if total <= self.max_bytes:
+                    break
+        self._conn.execute("UPDATE meta SET value = ? WHERE key = 'total_bytes'", (total,))
+
+    def page_text(
+        self, src_pdf: Union[str, Path], page_index: int, password: Optional[str] = None
+    ) -> PageText:
+        """Return cached text for a page, extracting and storing it on a miss."""
+        key = self.pdf_key(src_pdf)
+        cached = self.get(key, page_index)
+        if cached is not None:
+            return cached
+        with self._reader_lock:
+            # pypdf readers are not thread-safe; misses on one cache are serialized
+            reader = self._readers.get(key)
+            if reader is None:
+                reader = self._readers[key] = _open_pdf(src_pdf, password=password)[0]
+            page_text = extract_page_text(reader, page_index)
+        self.put(key, page_index, page_text)
+        return page_text
+
+
 ## URL/website TOC fetching intentionally removed; only manual text input is supported.
 
 
@@ -120,7 +120,7 @@ def test_batch_config_custom_format(tmp_path: Path, monkeypatch):
     # Capture calls to generate_bookmarks
     captured = {}
 
-    def fake_generate(src: str, out: str, headings):
+    def fake_generate(src: str, out: str, headings, password=None, reader=None):
         captured["src"] = Path(src)
         captured["out"] = Path(out)
         captured["headings"] = list(headings)
@@ -163,3 +163,462 @@ def test_parse_toc_lines_preserve_numbering_with_asterisk():
     assert any(t.startswith("*2 ") and "星标章节" in t for t in titles)
 
 
+
+
+def _write_blank_pdf(path: Path, pages: int = 1, password=None) -> Path:
+    from pypdf import PdfWriter
+
+    w = PdfWriter()
+    for _ in range(pages):
+        w.add_blank_page(width=100, height=100)
+    if password is not None:
+        w.encrypt(user_password=password, algorithm="RC4-128")
+    with path.open("wb") as f:
+        w.write(f)
+    return path
+
+
+def _write_text_pdf(path: Path, page_texts) -> Path:
+    # Build a PDF whose pages carry extractable text (Helvetica)
+    from pypdf import PdfWriter
+    from pypdf.generic import DecodedStreamObject, DictionaryObject, NameObject
+
+    w = PdfWriter()
+    font = DictionaryObject({
+        NameObject("/Type"): NameObject("/Font"),
+        NameObject("/Subtype"): NameObject("/Type1"),
+        NameObject("/BaseFont"): NameObject("/Helvetica"),
+    })
+    for text in page_texts:
+        page = w.add_blank_page(width=300, height=300)
+        stream = DecodedStreamObject()
+        # One text line per "\n"-separated line, 14pt apart
+        ops = " 0 -14 Td ".join(f"({line}) Tj" for line in text.split("\n"))
+        stream.set_data(f"BT /F1 12 Tf 20 250 Td {ops} ET".encode("latin-1"))
+        page[NameObject("/Contents")] = w._add_object(stream)
+        page[NameObject("/Resources")] = DictionaryObject({
+            NameObject("/Font"): DictionaryObject({NameObject("/F1"): font}),
+        })
+    with path.open("wb") as f:
+        w.write(f)
+    return path
+
+
+def test_verify_headings_flags_and_fixes_shifted_page(tmp_path: Path):
+    from tocsmith.core import fix_headings, verify_headings
+
+    pdf = _write_text_pdf(tmp_path / "t.pdf", [
+        "Preface",
+        "1 Getting Started with Parsers",
+        "Some body text",
+        "2 Advanced Outline Trees",
+    ])
+    hs = [
+        Heading(title="1 Getting Started with Parsers", page=2, level=1),
+        # OCR got this one wrong by one page
+        Heading(title="2 Advanced Outline Trees", page=3, level=1),
+    ]
+    checks = verify_headings(str(pdf), hs, window=1)
+    assert checks[0].ok and checks[0].score == 1.0
+    assert not checks[1].ok
+    assert checks[1].best_page == 4
+    fixed = fix_headings(checks)
+    assert [h.page for h in fixed] == [2, 4]
+
+
+def test_verify_headings_ignores_body_text_sharing_title_words(tmp_path: Path):
+    from tocsmith.core import fix_headings, verify_headings
+
+    pdf = _write_text_pdf(tmp_path / "t.pdf", [
+        "3 Memory Management\nThe paging hardware translates addresses.",
+        # Printed page: prose that mentions the next chapter's title words
+        "Later we return to virtual memory when we study\n"
+        "how the virtual memory system pages data in.",
+        "4 Virtual Memory\nDemand paging loads pages lazily.",
+    ])
+    hs = [Heading(title="4 Virtual Memory", page=2, level=1)]
+    checks = verify_headings(str(pdf), hs, window=1)
+    assert not checks[0].ok and checks[0].matched
+    assert checks[0].best_page == 3
+    assert checks[0].score < checks[0].best_score
+    assert [h.page for h in fix_headings(checks)] == [3]
+
+
+def test_verify_headings_keeps_printed_page_on_ties(tmp_path: Path):
+    from tocsmith.core import verify_headings
+
+    # A running header repeats the chapter title on the following page
+    pdf = _write_text_pdf(tmp_path / "t.pdf", [
+        "Preface",
+        "2 Parsing Tables\nBody text.",
+        "2 Parsing Tables\nMore body text.",
+    ])
+    checks = verify_headings(str(pdf), [Heading("2 Parsing Tables", 2, 1)])
+    assert checks[0].ok
+
+
+def test_verify_headings_process_pool(tmp_path: Path, monkeypatch):
+    from tocsmith import core
+    from tocsmith.core import verify_headings
+
+    monkeypatch.setattr(core, "_PROCESS_POOL_MIN_PAGES", 2)
+    words = ["Lexers", "Grammars", "Parsers", "Outlines", "Encodings", "Fonts"]
+    texts = [f"{i} Working with {w}" for i, w in enumerate(words, start=1)]
+    pdf = _write_text_pdf(tmp_path / "t.pdf", texts)
+    hs = [Heading(t, i, 1) for i, t in enumerate(texts, start=1)]
+    hs[2] = Heading(texts[3], 3, 1)  # printed one page early
+    checks = verify_headings(str(pdf), hs, max_workers=2)
+    assert [c.ok for c in checks] == [True, True, False, True, True, True]
+    assert checks[2].best_page == 4
+
+
+def test_verify_headings_flags_unmatched_and_keeps_page(tmp_path: Path):
+    from tocsmith.core import fix_headings, verify_headings
+
+    pdf = _write_text_pdf(tmp_path / "t.pdf", ["alpha", "beta", "gamma"])
+    checks = verify_headings(str(pdf), [Heading(title="Unrelated Title", page=2, level=1)])
+    assert not checks[0].ok and not checks[0].matched
+    assert checks[0].best_page == 2
+    assert [h.page for h in fix_headings(checks)] == [2]
+
+
+def test_verify_headings_matches_short_cjk_titles(tmp_path: Path, monkeypatch):
+    from tocsmith import core
+    from tocsmith.core import PageText, verify_headings
+
+    # Helvetica cannot carry CJK text, so feed page text straight into the checker
+    texts = ["前言", "第1章 基础\n本章介绍", "1.1 引言\n正文", "2 进阶"]
+
+    def fake_extract(self, page_index):
+        return PageText(text=texts[page_index])
+
+    monkeypatch.setattr(core._PageGrams, "_extract", fake_extract)
+    hs = [
+        Heading(title="第1章 基础", page=2, level=1),
+        Heading(title="1.1 引言", page=3, level=2),
+        Heading(title="2 进阶", page=3, level=1),  # off by one
+        Heading(title="*A", page=1, level=1),  # single character falls back to substring
+    ]
+    checks = verify_headings("unused.pdf", hs, num_pages=len(texts))
+    assert checks[0].ok and checks[0].score == 1.0
+    assert checks[1].ok and checks[1].score == 1.0
+    assert not checks[2].ok and checks[2].matched and checks[2].best_page == 4
+    assert not checks[3].matched
+
+
+def test_page_text_cache_roundtrip_and_reuse(tmp_path: Path, monkeypatch):
+    from tocsmith import core
+    from tocsmith.core import PageTextCache, verify_headings
+
+    pdf = _write_text_pdf(tmp_path / "t.pdf", ["Intro", "Chapter One Begins"])
+    with PageTextCache(tmp_path / "cache") as cache:
+        pt = cache.page_text(pdf, 1)
+        assert "Chapter One" in pt.text
+        assert pt.spans and pt.spans[0].font == "/Helvetica" and pt.spans[0].size == 12
+
+    # A new cache instance on the same directory serves pages without extraction
+    def fail_extract(reader, page_index):
+        raise AssertionError("page text should come from the cache")
+
+    monkeypatch.setattr(core, "extract_page_text", fail_extract)
+    with PageTextCache(tmp_path / "cache") as cache:
+        assert cache.page_text(pdf, 1).text == pt.text
+        cache.put(cache.pdf_key(pdf), 0, core.PageText(text="Intro"))
+        checks = verify_headings(str(pdf), [Heading("Chapter One Begins", 2, 1)], cache=cache)
+        assert checks[0].ok and checks[0].score == 1.0
+
+
+def test_page_text_cache_opens_each_pdf_once(tmp_path: Path, monkeypatch):
+    from tocsmith import core
+    from tocsmith.core import PageTextCache
+
+    pdf = _write_text_pdf(tmp_path / "t.pdf", ["one", "two", "three"])
+    opened = []
+    real_open = core._open_pdf
+
+    def counting_open(src_pdf, password=None):
+        opened.append(src_pdf)
+        return real_open(src_pdf, password=password)
+
+    monkeypatch.setattr(core, "_open_pdf", counting_open)
+    with PageTextCache(tmp_path / "cache") as cache:
+        assert [cache.page_text(pdf, i).text for i in range(3)] == ["one", "two", "three"]
+    assert len(opened) == 1
+
+
+def test_page_text_cache_evicts_least_recently_used(tmp_path: Path):
+    from tocsmith.core import PageText, PageTextCache
+
+    with PageTextCache(tmp_path / "cache", max_bytes=250) as cache:
+        for i in range(3):
+            cache.put("h", i, PageText(text="x" * 100))
+        assert cache.get("h", 0) is None
+        assert cache.get("h", 1) is not None and cache.get("h", 2) is not None
+        # Touching page 1 makes page 2 the eviction candidate
+        cache.get("h", 1)
+        cache.put("h", 3, PageText(text="y" * 100))
+        assert cache.get("h", 2) is None and cache.get("h", 1) is not None
+        assert cache.total_bytes <= 250
+
+
+def test_batch_sources_glob_with_sidecar_toc(tmp_path: Path, monkeypatch):
+    input_dir = tmp_path / "input"
+    (input_dir / "sub").mkdir(parents=True)
+    for rel in ("a.pdf", "sub/b.pdf", "sub/no_toc.pdf"):
+        _write_blank_pdf(input_dir / rel)
+    (input_dir / "a.toc.txt").write_text("第一章 绪论 1\n", encoding="utf-8")
+    (input_dir / "sub" / "b.toc.txt").write_text(
+        "+++\npage_offset = 5\n+++\n第一章 绪论 1\n1.1 引言 2\n", encoding="utf-8"
+    )
+
+    config_path = tmp_path / "config.toml"
+    config_path.write_text(textwrap.dedent('''
+        [defaults]
+        min_len = 1
+        input_prefix = "input"
+        output_prefix = "output"
+
+        [[sources]]
+        glob = "**/*.pdf"
+        toc_suffix = ".toc.txt"
+        page_offset = 2
+        ''').strip(), encoding="utf-8")
+
+    captured = {}
+
+    def fake_generate(src: str, out: str, headings, password=None, reader=None):
+        captured[Path(src).name] = (Path(out), list(headings))
+
+    monkeypatch.setattr(cli, "generate_bookmarks", fake_generate)
+
+    assert cli._run_batch(config_path) == 0
+    assert sorted(captured) == ["a.pdf", "b.pdf"]
+    out_a, hs_a = captured["a.pdf"]
+    out_b, hs_b = captured["b.pdf"]
+    assert out_a == (tmp_path / "output" / "a.bookmarked.pdf").resolve()
+    assert out_b == (tmp_path / "output" / "sub" / "b.bookmarked.pdf").resolve()
+    # Source default offset vs. sidecar front matter override
+    assert [h.page for h in hs_a] == [3]
+    assert [h.page for h in hs_b] == [6, 7]
+
+
+def test_iter_glob_patterns(tmp_path: Path):
+    for rel in ("x.pdf", "d/y.pdf", "d/e/z.pdf", "d/notes.txt"):
+        p = tmp_path / rel
+        p.parent.mkdir(parents=True, exist_ok=True)
+        p.write_bytes(b"")
+
+    def rels(pattern):
+        return sorted(p.relative_to(tmp_path).as_posix() for p in cli._iter_glob(tmp_path, pattern))
+
+    assert rels("*.pdf") == ["x.pdf"]
+    assert rels("d/*.pdf") == ["d/y.pdf"]
+    assert rels("**/*.pdf") == ["d/e/z.pdf", "d/y.pdf", "x.pdf"]
+
+
+def test_iter_glob_prunes_on_literal_segments(tmp_path: Path, monkeypatch):
+    import os
+
+    for rel in ("books/a.pdf", "other/b.pdf", "other/deep/c.pdf"):
+        p = tmp_path / rel
+        p.parent.mkdir(parents=True, exist_ok=True)
+        p.write_bytes(b"")
+
+    scanned = []
+    real_scandir = os.scandir
+
+    def recording_scandir(path):
+        scanned.append(Path(path).relative_to(tmp_path).as_posix())
+        return real_scandir(path)
+
+    monkeypatch.setattr(cli.os, "scandir", recording_scandir)
+    found = [p.relative_to(tmp_path).as_posix() for p in cli._iter_glob(tmp_path, "books/*.pdf")]
+    assert found == ["books/a.pdf"]
+    assert sorted(scanned) == [".", "books"]
+
+
+def test_batch_sources_zero_offset_in_front_matter_wins(tmp_path: Path, monkeypatch):
+    input_dir = tmp_path / "input"
+    input_dir.mkdir()
+    _write_blank_pdf(input_dir / "a.pdf")
+    (input_dir / "a.toc.txt").write_text(
+        "+++\npage_offset = 0\n+++\n第一章 绪论 1\n", encoding="utf-8"
+    )
+    config_path = tmp_path / "config.toml"
+    config_path.write_text(textwrap.dedent('''
+        [defaults]
+        page_offset = 7
+        min_len = 1
+        input_prefix = "input"
+
+        [[sources]]
+        glob = "*.pdf"
+        page_offset = 3
+        ''').strip(), encoding="utf-8")
+
+    captured = {}
+
+    def fake_generate(src: str, out: str, headings, password=None, reader=None):
+        captured["headings"] = list(headings)
+
+    monkeypatch.setattr(cli, "generate_bookmarks", fake_generate)
+    assert cli._run_batch(config_path) == 0
+    assert [h.page for h in captured["headings"]] == [1]
+
+
+def test_batch_sources_bad_front_matter_value_does_not_stop_batch(tmp_path: Path, capsys):
+    input_dir = tmp_path / "input"
+    input_dir.mkdir()
+    for name, front in (("a", 'page_offset = "twelve"'), ("b", "page_offset = 1")):
+        _write_blank_pdf(input_dir / f"{name}.pdf", pages=2)
+        (input_dir / f"{name}.toc.txt").write_text(
+            f"+++\n{front}\n+++\nIntro 1\n", encoding="utf-8"
+        )
+    config_path = tmp_path / "config.toml"
+    config_path.write_text(textwrap.dedent('''
+        [defaults]
+        min_len = 1
+        input_prefix = "input"
+        output_prefix = "output"
+
+        [[sources]]
+        glob = "*.pdf"
+        ''').strip(), encoding="utf-8")
+
+    assert cli._run_batch(config_path) == 1
+    out = capsys.readouterr().out
+    assert "Completed with 1 failure(s) (config: 1)" in out
+    assert (tmp_path / "output" / "b.bookmarked.pdf").exists()
+
+
+def test_iter_glob_does_not_follow_directory_symlinks(tmp_path: Path):
+    import os
+
+    (tmp_path / "sub").mkdir()
+    (tmp_path / "a.pdf").write_bytes(b"")
+    (tmp_path / "sub" / "b.pdf").write_bytes(b"")
+    try:
+        os.symlink("..", tmp_path / "sub" / "loop", target_is_directory=True)
+    except (OSError, NotImplementedError):
+        pytest.skip("symlinks not supported here")
+
+    found = sorted(p.relative_to(tmp_path).as_posix() for p in cli._iter_glob(tmp_path, "**/*.pdf"))
+    assert found == ["a.pdf", "sub/b.pdf"]
+
+
+def test_preflight_rejects_non_pdf_and_corrupt(tmp_path: Path):
+    from tocsmith.core import PdfPreflightError, preflight_pdf
+
+    cases = {
+        "missing": tmp_path / "nope.pdf",
+        "not_pdf": tmp_path / "text.pdf",
+        "corrupt": tmp_path / "broken.pdf",
+    }
+    cases["not_pdf"].write_text("hello", encoding="utf-8")
+    cases["corrupt"].write_bytes(b"%PDF-1.4\ngarbage")
+    for category, path in cases.items():
+        with pytest.raises(PdfPreflightError) as ei:
+            preflight_pdf(path)
+        assert ei.value.category == category
+
+
+def test_preflight_encrypted_with_password(tmp_path: Path):
+    from pypdf import PdfReader
+    from tocsmith.core import PdfPreflightError, preflight_pdf
+
+    src = _write_blank_pdf(tmp_path / "enc.pdf", password="pw")
+
+    with pytest.raises(PdfPreflightError) as ei:
+        preflight_pdf(src, passwords=["wrong"])
+    assert ei.value.category == "encrypted"
+
+    hs = [Heading("Intro", 1, 1), Heading("Appendix", 9, 1)]
+    pre = preflight_pdf(src, passwords=["wrong", "pw"], headings=hs)
+    assert pre.encrypted and pre.password == "pw" and pre.num_pages == 1
+    assert [h.title for h in pre.out_of_range] == ["Appendix"]
+
+    out = tmp_path / "out.pdf"
+    generate_bookmarks(str(src), str(out), hs[:1], password=pre.password)
+    assert len(PdfReader(str(out)).outline) == 1
+
+
+def test_batch_summary_reports_failure_categories(tmp_path: Path, capsys):
+    input_dir = tmp_path / "input"
+    input_dir.mkdir()
+    (input_dir / "bad.pdf").write_text("not a pdf", encoding="utf-8")
+    _write_blank_pdf(input_dir / "good.pdf")
+
+    config_path = tmp_path / "config.toml"
+    config_path.write_text(textwrap.dedent('''
+        [defaults]
+        input_prefix = "input"
+        output_prefix = "output"
+
+        [[tasks]]
+        input_file = "bad.pdf"
+        toc = "Intro 1"
+
+        [[tasks]]
+        input_file = "missing.pdf"
+
+        [[tasks]]
+        input_file = "good.pdf"
+        toc = "Intro 1"
+        ''').strip(), encoding="utf-8")
+
+    assert cli._run_batch(config_path) == 1
+    out = capsys.readouterr().out
+    assert "Completed with 2 failure(s) (missing: 1, not_pdf: 1)" in out
+    assert (tmp_path / "output" / "good.bookmarked.pdf").exists()
+
+
+def test_preflight_recovers_pdf_truncated_before_eof(tmp_path: Path):
+    from pypdf import PdfReader
+    from tocsmith.core import preflight_pdf
+
+    good = _write_blank_pdf(tmp_path / "good.pdf", pages=3)
+    assert preflight_pdf(good).recovered is False
+
+    data = good.read_bytes()
+    broken = tmp_path / "broken.pdf"
+    broken.write_bytes(data[: data.rindex(b"startxref")])
+    pre = preflight_pdf(broken)
+    assert pre.recovered and pre.num_pages == 3
+
+    out = tmp_path / "out.pdf"
+    generate_bookmarks(str(broken), str(out), [Heading("Intro", 2, 1)])
+    assert len(PdfReader(str(out)).pages) == 3
+
+
+def test_open_pdf_wrong_password_skips_recovery(tmp_path: Path, monkeypatch):
+    from pypdf.errors import FileNotDecryptedError
+    from tocsmith import core
+
+    src = _write_blank_pdf(tmp_path / "enc.pdf", password="pw")
+
+    def no_read_bytes(self):
+        raise AssertionError("recovery should not re-read the file")
+
+    monkeypatch.setattr(Path, "read_bytes", no_read_bytes)
+    with pytest.raises(FileNotDecryptedError):
+        core._open_pdf(src, password="wrong")
+
+
+def test_run_single_reuses_preflight_reader(tmp_path: Path, monkeypatch):
+    from tocsmith import core
+
+    pdf = _write_text_pdf(tmp_path / "t.pdf", ["Preface", "1 Getting Started"])
+    toc = tmp_path / "toc.txt"
+    toc.write_text("1 Getting Started 2\n", encoding="utf-8")
+    opened = []
+    real_open = core._open_pdf
+
+    def counting_open(src_pdf, password=None):
+        opened.append(src_pdf)
+        return real_open(src_pdf, password=password)
+
+    monkeypatch.setattr(core, "_open_pdf", counting_open)
+    code = cli._run_single(
+        src=pdf, out=tmp_path / "out.pdf", toc_file=toc, page_offset=0, min_len=1, verify="fix"
+    )
+    assert code == 0 and len(opened) == 1